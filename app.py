@@ -1,47 +1,63 @@
 import os
+import asyncio
 import sqlite3
 import json
 import math
 import datetime
+import threading
+import time
+from collections import namedtuple
+from functools import lru_cache
 from fastapi import FastAPI, Request, Form, Depends, HTTPException, status
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from typing import List, Dict, Optional
 
+# ek_ozellikler metinleri birkaç farklı değerden ibaret olduğu için her biri bir kez ayrıştırılır.
+# Boş veya hatalı JSON {} olarak döner.
+@lru_cache(maxsize=128)
+def _safe_json(s: str) -> dict:
+    if not s: return {}
+    try:
+        return json.loads(s)
+    except json.JSONDecodeError:
+        return {}
+
+# SQLite'ın tek sorguda kabul ettiği varsayılan en fazla parametre sayısı
+SQLITE_MAX_PARAMETRE = 999
+
 # --- Veritabanı Yöneticisi Sınıfı (Değişmeden Kalabilir) ---
 # Bu kısım Flask'tan bağımsız olduğu için büyük ölçüde aynı kalabilir.
 # Ancak, veritabanı bağlantılarının yönetimi FastAPI context'ine daha uygun hale getirilebilir.
 class VeritabaniYoneticisi:
-    def __init__(self, db_adi=None): # Varsayılan değeri None yapıyoruz
+    # Tablo ve sütun kümesine göre üretilmiş INSERT/UPDATE sorguları. Her istek kendi yöneticisini
+    # oluşturduğundan önbellek sınıf düzeyinde tutulur; aynı SQL metni sqlite3'ün hazır ifade önbelleğine de isabet eder.
+    _sql_cache = {}
+
+    def __init__(self, db_adi=None, conn=None): # Varsayılan değeri None yapıyoruz
         # Ortam değişkeninden DB_PATH'i okumaya çalış, yoksa varsayılan bir değer kullan
         # Örn: /app/data/malzeme_veritabani.db (bu dizini Portainer'da bağlayacağız)
         self.db_adi = db_adi if db_adi else os.getenv("DB_PATH", "/app/data/malzeme_veritabani.db")
-        self.conn = None
+        # Havuzdan ödünç alınan bir bağlantı verilirse o kullanılır ve burada kapatılmaz
+        self.conn = conn
+        self._baglanti_sahibi = conn is None
 
     def baglan(self):
         try:
-            if self.conn is None or not self._is_connection_active():
-                self.conn = sqlite3.connect(self.db_adi)
+            if self.conn is None:
+                self.conn = sqlite3.connect(self.db_adi, check_same_thread=False)
                 self.conn.row_factory = sqlite3.Row
+                self.conn.execute("PRAGMA cache_size=-20000")
             return self.conn
         except sqlite3.Error as e:
             print(f"Veritabanı bağlantı hatası: {e}")
             self.conn = None
             return None
 
-    def _is_connection_active(self):
-        if self.conn:
-            try:
-                self.conn.execute("SELECT 1").fetchone()
-                return True
-            except sqlite3.Error:
-                return False
-        return False
-
     def baglantiyi_kapat(self):
-        if self.conn:
+        if self.conn and self._baglanti_sahibi:
             self.conn.close()
-            self.conn = None
+        self.conn = None
 
     def tablo_olustur(self):
         conn = self.baglan()
@@ -91,14 +107,55 @@ class VeritabaniYoneticisi:
                 FOREIGN KEY (varsayilan_malzeme_id) REFERENCES Malzemeler(malzeme_id) ON DELETE SET NULL
             );
         ''')
+        # Her malzemenin son fiyatı latest_fiyat_id üzerinden doğrudan okunur; sütun Fiyatlar'a
+        # yapılan her eklemede tetikleyiciyle güncellenir. Eski veritabanlarında sütun bir kez eklenip doldurulur.
+        malzeme_sutunlari = [row["name"] for row in cursor.execute("PRAGMA table_info(Malzemeler)")]
+        if "latest_fiyat_id" not in malzeme_sutunlari:
+            cursor.execute("ALTER TABLE Malzemeler ADD COLUMN latest_fiyat_id INTEGER REFERENCES Fiyatlar(fiyat_id)")
+            cursor.execute('''
+                UPDATE Malzemeler SET latest_fiyat_id = (
+                    SELECT fiyat_id FROM Fiyatlar
+                    WHERE malzeme_id = Malzemeler.malzeme_id
+                    ORDER BY gecerlilik_tarihi DESC, fiyat_id DESC
+                    LIMIT 1
+                );
+            ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_fiyat_ai
+            AFTER INSERT ON Fiyatlar BEGIN
+                UPDATE Malzemeler SET latest_fiyat_id = NEW.fiyat_id
+                WHERE malzeme_id = NEW.malzeme_id
+                  AND NEW.gecerlilik_tarihi >= COALESCE(
+                      (SELECT gecerlilik_tarihi FROM Fiyatlar WHERE fiyat_id = Malzemeler.latest_fiyat_id), '');
+            END;
+        ''')
+        # Bir malzemenin aynı gün için tek fiyatı olur; yönetim formu bu indeks üzerinden upsert yapar.
+        # İndeks ilk kez oluşturulurken aynı güne ait eski mükerrer kayıtlardan yalnızca geçerli olan (en sonuncusu) tutulur.
+        if not cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_fiyatlar_malz_gun'").fetchone():
+            cursor.execute("DELETE FROM Fiyatlar WHERE fiyat_id NOT IN (SELECT MAX(fiyat_id) FROM Fiyatlar GROUP BY malzeme_id, gecerlilik_tarihi)")
+            cursor.execute("CREATE UNIQUE INDEX idx_fiyatlar_malz_gun ON Fiyatlar(malzeme_id, gecerlilik_tarihi)")
+        # Malzeme hesabındaki sık aramalar için indeksler.
+        # malzeme_adi için UNIQUE kısıtının oluşturduğu otomatik indeks zaten kullanılıyor.
+        # Son fiyat latest_fiyat_id ile rowid üzerinden okunur; malzeme_id ile Fiyatlar aramaları idx_fiyatlar_malz_gun'u kullanır
+        cursor.execute("DROP INDEX IF EXISTS idx_fiyatlar_malz_tarih")
+        cursor.execute("DROP INDEX IF EXISTS idx_fiyatlar_latest")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sarfiyat_malz ON Sarfiyatlar(malzeme_id)")
+        # UygulamaDetaylari hesap başına tek seferde tamamen okunur; bu tabloda arama indeksi gerekmez
+        cursor.execute("DROP INDEX IF EXISTS idx_uygulama_oda_alan")
+        # Kategori indeksi malzeme_adi'nı da içerir; kaplama tipi listesi yalnızca indeksten okunur
+        cursor.execute("DROP INDEX IF EXISTS idx_malzeme_kat")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_malzeme_kat_adi ON Malzemeler(malzeme_kategori, malzeme_adi)")
         conn.commit()
 
     def veri_ekle(self, tablo_adı, veri_dict):
         conn = self.baglan()
         if not conn: return None
-        sutunlar = ', '.join(veri_dict.keys())
-        yer_tutucular = ', '.join(['?' for _ in veri_dict.values()])
-        sorgu = f"INSERT INTO {tablo_adı} ({sutunlar}) VALUES ({yer_tutucular})"
+        anahtar = (tablo_adı, tuple(veri_dict.keys()))
+        sorgu = self._sql_cache.get(anahtar)
+        if sorgu is None:
+            sutunlar = ', '.join(veri_dict.keys())
+            yer_tutucular = ', '.join(['?' for _ in veri_dict.values()])
+            sorgu = self._sql_cache[anahtar] = f"INSERT INTO {tablo_adı} ({sutunlar}) VALUES ({yer_tutucular})"
         try:
             cursor = conn.cursor()
             cursor.execute(sorgu, tuple(veri_dict.values()))
@@ -113,9 +170,12 @@ class VeritabaniYoneticisi:
     def veri_guncelle(self, tablo_adı, veri_dict, kosullar):
         conn = self.baglan()
         if not conn: return False
-        set_clause = ", ".join([f"{k} = ?" for k in veri_dict.keys()])
-        where_clause = " AND ".join([f"{k} = ?" for k in kosullar.keys()])
-        sorgu = f"UPDATE {tablo_adı} SET {set_clause} WHERE {where_clause}"
+        anahtar = (tablo_adı, tuple(veri_dict.keys()), tuple(kosullar.keys()))
+        sorgu = self._sql_cache.get(anahtar)
+        if sorgu is None:
+            set_clause = ", ".join([f"{k} = ?" for k in veri_dict.keys()])
+            where_clause = " AND ".join([f"{k} = ?" for k in kosullar.keys()])
+            sorgu = self._sql_cache[anahtar] = f"UPDATE {tablo_adı} SET {set_clause} WHERE {where_clause}"
         try:
             cursor = conn.cursor()
             cursor.execute(sorgu, tuple(list(veri_dict.values()) + list(kosullar.values())))
@@ -141,30 +201,139 @@ class VeritabaniYoneticisi:
             return []
 
     def malzeme_bilgisi_getir(self, malzeme_adi_veya_kategori):
+        # Ada göre eşleşme kategoriye göre eşleşmeden önce gelir; ayrıntılar toplu sorguda
+        return self.malzeme_bilgisi_toplu_getir([malzeme_adi_veya_kategori]).get(malzeme_adi_veya_kategori)
+
+    def malzeme_bilgisi_toplu_getir(self, malzeme_adlari_veya_kategoriler):
+        # Birden çok malzemeyi (ad veya kategoriye göre) son fiyat ve sarfiyatlarıyla tek seferde getirir.
+        # Sonuç {ad: malzeme_bilgisi_getir ile aynı yapı} sözlüğüdür; bulunamayan adlar yer almaz.
         conn = self.baglan()
-        if not conn: return None
-        malzeme_data = self.veri_sorgula("Malzemeler", {"malzeme_adi": malzeme_adi_veya_kategori})
-        if not malzeme_data:
-            malzeme_data = self.veri_sorgula("Malzemeler", {"malzeme_kategori": malzeme_adi_veya_kategori})
-        if not malzeme_data:
-            return None
-        malzeme = dict(malzeme_data[0])
-        malzeme_id = malzeme["malzeme_id"]
-
-        fiyat_data_raw = conn.execute("""
-            SELECT * FROM Fiyatlar
-            WHERE malzeme_id = ?
-            ORDER BY gecerlilik_tarihi DESC, fiyat_id DESC
-            LIMIT 1
-        """, (malzeme_id,)).fetchall()
-
-        sarfiyat_data = self.veri_sorgula("Sarfiyatlar", {"malzeme_id": malzeme_id})
-
-        return {
-            "malzeme": malzeme,
-            "fiyat": dict(fiyat_data_raw[0]) if fiyat_data_raw else None,
-            "sarfiyat": [dict(s) for s in sarfiyat_data] if sarfiyat_data else []
-        }
+        if not conn: return {}
+        anahtarlar = list(dict.fromkeys(malzeme_adlari_veya_kategoriler))
+        if not anahtarlar: return {}
+
+        # Maliyet hesabında kullanılan sütunlar; açıklama, tedarikçi vb. okunmaz
+        malzeme_sutunlari = ("malzeme_id", "malzeme_adi", "malzeme_kategori", "birim_olcu_tipi", "varsayilan_fire_orani")
+        fiyat_sutunlari = ("fiyat_id", "birim_fiyat")
+        sarfiyat_sutunlari = ("malzeme_id", "uygulama_turu", "sarfiyat_degeri")
+        secilen_sutunlar = ', '.join([f"M.{k}" for k in malzeme_sutunlari] + [f"F.{k}" for k in fiyat_sutunlari])
+        malzeme_satirlari = []
+        sarfiyat_satirlari = []
+        try:
+            # Ad ve kategori için aynı liste iki kez bağlandığından parça boyu yarıya iner
+            parca_boyu = SQLITE_MAX_PARAMETRE // 2
+            for i in range(0, len(anahtarlar), parca_boyu):
+                parca = anahtarlar[i:i + parca_boyu]
+                yer_tutucular = ', '.join(['?' for _ in parca])
+                malzeme_satirlari.extend(conn.execute(f"""
+                    SELECT {secilen_sutunlar}
+                    FROM Malzemeler AS M
+                    LEFT JOIN Fiyatlar AS F ON F.fiyat_id = M.latest_fiyat_id
+                    WHERE M.malzeme_adi IN ({yer_tutucular}) OR M.malzeme_kategori IN ({yer_tutucular})
+                    ORDER BY M.malzeme_id
+                """, tuple(parca) * 2).fetchall())
+
+            malzeme_idleri = list(dict.fromkeys(row["malzeme_id"] for row in malzeme_satirlari))
+            for i in range(0, len(malzeme_idleri), SQLITE_MAX_PARAMETRE):
+                parca = malzeme_idleri[i:i + SQLITE_MAX_PARAMETRE]
+                yer_tutucular = ', '.join(['?' for _ in parca])
+                sarfiyat_satirlari.extend(conn.execute(
+                    f"SELECT {', '.join(sarfiyat_sutunlari)} FROM Sarfiyatlar WHERE malzeme_id IN ({yer_tutucular}) ORDER BY sarfiyat_id",
+                    tuple(parca)
+                ).fetchall())
+        except sqlite3.Error as e:
+            print(f"Toplu malzeme sorgulama hatası: {e}")
+            return {}
+
+        sarfiyatlar = {}
+        for s in sarfiyat_satirlari:
+            sarfiyatlar.setdefault(s["malzeme_id"], []).append(dict(s))
+
+        ada_gore = {}
+        kategoriye_gore = {}
+        for row in malzeme_satirlari:
+            malzeme = dict(row)
+            fiyat = {k: malzeme.pop(k) for k in fiyat_sutunlari}
+            fiyat["malzeme_id"] = malzeme["malzeme_id"]
+            bilgi = {
+                "malzeme": malzeme,
+                "fiyat": fiyat if fiyat["fiyat_id"] is not None else None,
+                "sarfiyat": sarfiyatlar.get(malzeme["malzeme_id"], [])
+            }
+            ada_gore[malzeme["malzeme_adi"]] = bilgi
+            # Kategoriye göre aramada, tekli sorgudaki gibi ilk eşleşen malzeme kullanılır
+            kategoriye_gore.setdefault(malzeme["malzeme_kategori"], bilgi)
+
+        sonuc = {}
+        for anahtar in anahtarlar:
+            bilgi = ada_gore.get(anahtar) or kategoriye_gore.get(anahtar)
+            if bilgi:
+                sonuc[anahtar] = bilgi
+        return sonuc
+
+    def uygulama_detaylari_haritasi(self):
+        # UygulamaDetaylari tablosunu tek sorguda {(oda_tipi, uygulama_alani): ek_ozellikler} olarak döndürür
+        conn = self.baglan()
+        if not conn: return {}
+        try:
+            rows = conn.execute(
+                "SELECT oda_tipi, uygulama_alani, ek_ozellikler FROM UygulamaDetaylari ORDER BY detay_id"
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Veri sorgulama hatası (UygulamaDetaylari): {e}")
+            return {}
+
+        harita = {}
+        for row in rows:
+            # Aynı oda/alan için birden çok kayıt varsa ilki geçerlidir
+            harita.setdefault((row["oda_tipi"], row["uygulama_alani"]), _safe_json(row["ek_ozellikler"]))
+        return harita
+
+# --- SQLite Bağlantı Havuzu ---
+# Bağlantılar uygulama açılışında bir kez açılır, istekler arasında kapatılmadan yeniden kullanılır.
+class SQLitePool:
+    def __init__(self, db_adi=None, boyut=5):
+        # VeritabaniYoneticisi ile aynı DB_PATH varsayılanı
+        self.db_adi = db_adi if db_adi else os.getenv("DB_PATH", "/app/data/malzeme_veritabani.db")
+        self.boyut = boyut
+        self._kuyruk = None
+        self._baglantilar = []
+
+    def _baglanti_ac(self):
+        conn = sqlite3.connect(self.db_adi, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-20000")
+        return conn
+
+    def ac(self):
+        self._kuyruk = asyncio.Queue(maxsize=self.boyut)
+        for _ in range(self.boyut):
+            conn = self._baglanti_ac()
+            self._baglantilar.append(conn)
+            self._kuyruk.put_nowait(conn)
+
+    def isit(self):
+        # Şema her bağlantıda ilk sorguda ayrıştırılır; bunu açılışta yaparak ilk isteği bu maliyetten kurtar
+        for conn in self._baglantilar:
+            conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+    async def acquire(self, timeout=None):
+        # timeout dolarsa asyncio.TimeoutError yükselir
+        return await asyncio.wait_for(self._kuyruk.get(), timeout)
+
+    def release(self, conn):
+        # Yarım kalmış bir işlem (ör. yakalanmış bir hata sonrası) sonraki isteğe taşınmasın
+        if conn.in_transaction:
+            conn.rollback()
+        self._kuyruk.put_nowait(conn)
+
+    def kapat(self):
+        for conn in self._baglantilar:
+            conn.close()
+        self._baglantilar = []
+        self._kuyruk = None
 
 # --- Ev Hesaplayıcı Sınıfı (Değişmeden Kalabilir) ---
 # Bu sınıf da doğrudan Flask'a bağımlı olmadığı için aynı kalabilir.
@@ -209,13 +378,26 @@ class EvHesaplayici:
     def malzeme_ihtiyacini_hesapla(self):
         self._alan_hesapla()
         self.malzeme_ihtiyaclari = {}
-        toplam_maliyet_temp = 0.0
+        # Kalem maliyetleri toplanıp en sonda tek seferde toplanır
+        _maliyet_list = []
+
+        # Hesapta kullanılacak tüm malzemeleri tek seferde veritabanından al
+        gerekli_malzemeler = ["Duvar Paneli", "Çatı Paneli", "PVC Pencere", "Dış Kapı", "İç Kapı"]
+        for oda in self.ev_bilgileri["oda_listesi"]:
+            gerekli_malzemeler.append(oda["zemin_kaplama_tipi"])
+            gerekli_malzemeler.append(oda["duvar_kaplama_tipi"])
+        malzeme_bilgileri = self.db.malzeme_bilgisi_toplu_getir(gerekli_malzemeler)
+        self._uygulama_map = self.db.uygulama_detaylari_haritasi()
+        # Pencere ve kapı döngülerinde her satır için aynı malzeme kullanılır
+        pvc_info = malzeme_bilgileri.get("PVC Pencere")
+        dis_kapi_info = malzeme_bilgileri.get("Dış Kapı")
+        ic_kapi_info = malzeme_bilgileri.get("İç Kapı")
 
         # --- Duvar Panelleri ---
         net_duvar_alani_paneller_icin = self.toplam_duvar_alani_brut - self.toplam_pencere_alani - self.toplam_kapi_alani
         if net_duvar_alani_paneller_icin < 0: net_duvar_alani_paneller_icin = 0
 
-        malzeme_info = self.db.malzeme_bilgisi_getir("Duvar Paneli")
+        malzeme_info = malzeme_bilgileri.get("Duvar Paneli")
         if malzeme_info and malzeme_info["fiyat"]:
             malzeme = malzeme_info["malzeme"]
             fiyat = malzeme_info["fiyat"]
@@ -228,12 +410,12 @@ class EvHesaplayici:
                 "birim_fiyat": fiyat["birim_fiyat"],
                 "maliyet": maliyet
             }
-            toplam_maliyet_temp += maliyet
+            _maliyet_list.append(maliyet)
         # else: # Flash mesajları FastAPI'de farklı yönetilecek
         #     flash("Duvar Paneli bilgisi veritabanında bulunamadı veya fiyatı yok.", "warning")
 
         # --- Çatı Kaplama Malzemesi ---
-        malzeme_info = self.db.malzeme_bilgisi_getir("Çatı Paneli")
+        malzeme_info = malzeme_bilgileri.get("Çatı Paneli")
         if malzeme_info and malzeme_info["fiyat"]:
             malzeme = malzeme_info["malzeme"]
             fiyat = malzeme_info["fiyat"]
@@ -246,7 +428,7 @@ class EvHesaplayici:
                 "birim_fiyat": fiyat["birim_fiyat"],
                 "maliyet": maliyet
             }
-            toplam_maliyet_temp += maliyet
+            _maliyet_list.append(maliyet)
         # else:
         #     flash("Çatı Paneli bilgisi veritabanında bulunamadı veya fiyatı yok.", "warning")
 
@@ -266,19 +448,12 @@ class EvHesaplayici:
 
             # Zemin Kaplama
             malzeme_adi_zemin = oda["zemin_kaplama_tipi"]
-            malzeme_info_zemin = self.db.malzeme_bilgisi_getir(malzeme_adi_zemin)
+            malzeme_info_zemin = malzeme_bilgileri.get(malzeme_adi_zemin)
             if malzeme_info_zemin and malzeme_info_zemin["fiyat"]:
                 malzeme = malzeme_info_zemin["malzeme"]
                 fiyat = malzeme_info_zemin["fiyat"]
 
-                uygulama_detaylari_raw = self.db.veri_sorgula("UygulamaDetaylari",
-                                                    {"oda_tipi": oda_adi, "uygulama_alani": "Zemin"})
-                ek_ozellikler = {}
-                if uygulama_detaylari_raw and uygulama_detaylari_raw[0]["ek_ozellikler"]:
-                    try:
-                        ek_ozellikler = json.loads(uygulama_detaylari_raw[0]["ek_ozellikler"])
-                    except json.JSONDecodeError:
-                        pass # flash(f"{oda_adi} Zemin için uygulama detaylarındaki JSON hatalı.", "warning")
+                ek_ozellikler = self._uygulama_map.get((oda_adi, "Zemin"), {})
 
                 if malzeme["malzeme_adi"] == "Fayans" and "fayans_boyut_m2" in ek_ozellikler and ek_ozellikler["fayans_boyut_m2"] > 0:
                     fayans_m2 = ek_ozellikler["fayans_boyut_m2"]
@@ -301,13 +476,13 @@ class EvHesaplayici:
                         "birim_fiyat": fiyat["birim_fiyat"],
                         "maliyet": maliyet
                     }
-                toplam_maliyet_temp += maliyet
+                _maliyet_list.append(maliyet)
             # else:
             #     flash(f"{oda_adi} için {malzeme_adi_zemin} zemin kaplama bilgisi veritabanında bulunamadı veya fiyatı yok.", "warning")
 
             # Duvar Kaplama
             malzeme_adi_duvar = oda["duvar_kaplama_tipi"]
-            malzeme_info_duvar = self.db.malzeme_bilgisi_getir(malzeme_adi_duvar)
+            malzeme_info_duvar = malzeme_bilgileri.get(malzeme_adi_duvar)
             if malzeme_info_duvar and malzeme_info_duvar["fiyat"]:
                 malzeme = malzeme_info_duvar["malzeme"]
                 fiyat = malzeme_info_duvar["fiyat"]
@@ -316,14 +491,7 @@ class EvHesaplayici:
                     sarfiyat_data = [s for s in malzeme_info_duvar["sarfiyat"] if s["uygulama_turu"] == "Duvar"]
                     if sarfiyat_data:
                         sarfiyat_degeri = sarfiyat_data[0]["sarfiyat_degeri"]
-                        uygulama_detaylari_raw = self.db.veri_sorgula("UygulamaDetaylari",
-                                                            {"oda_tipi": oda_adi, "uygulama_alani": "Duvar"})
-                        ek_ozellikler = {}
-                        if uygulama_detaylari_raw and uygulama_detaylari_raw[0]["ek_ozellikler"]:
-                            try:
-                                ek_ozellikler = json.loads(uygulama_detaylari_raw[0]["ek_ozellikler"])
-                            except json.JSONDecodeError:
-                                pass # flash(f"{oda_adi} Duvar için uygulama detaylarındaki JSON hatalı.", "warning")
+                        ek_ozellikler = self._uygulama_map.get((oda_adi, "Duvar"), {})
 
                         kat_sayisi = ek_ozellikler.get("kat_sayisi", 1)
 
@@ -336,7 +504,7 @@ class EvHesaplayici:
                             "birim_fiyat": fiyat["birim_fiyat"],
                             "maliyet": maliyet
                         }
-                        toplam_maliyet_temp += maliyet
+                        _maliyet_list.append(maliyet)
                     # else:
                     #     flash(f"{oda_adi} için {malzeme_adi_duvar} boya sarfiyat bilgisi bulunamadı.", "warning")
                 else:
@@ -349,13 +517,13 @@ class EvHesaplayici:
                         "birim_fiyat": fiyat["birim_fiyat"],
                         "maliyet": maliyet
                     }
-                toplam_maliyet_temp += maliyet
+                    _maliyet_list.append(maliyet)
             # else:
             #     flash(f"{oda_adi} için {malzeme_adi_duvar} duvar kaplama bilgisi veritabanında bulunamadı veya fiyatı yok.", "warning")
 
         # --- Pencereler ---
         for i, pencere in enumerate(self.ev_bilgileri["pencere_listesi"]):
-            malzeme_info = self.db.malzeme_bilgisi_getir("PVC Pencere")
+            malzeme_info = pvc_info
             if malzeme_info and malzeme_info["fiyat"]:
                 malzeme = malzeme_info["malzeme"]
                 fiyat = malzeme_info["fiyat"]
@@ -369,14 +537,16 @@ class EvHesaplayici:
                     "birim_fiyat": fiyat["birim_fiyat"],
                     "maliyet": maliyet
                 }
-                toplam_maliyet_temp += maliyet
+                _maliyet_list.append(maliyet)
             # else:
             #     flash(f"Pencere {i+1} için 'PVC Pencere' bilgisi veritabanında bulunamadı veya fiyatı yok.", "warning")
 
         # --- Kapılar ---
+        # Kapı türü döngüden önce bir kez belirlenir; döngüde malzeme yalnızca indeksle seçilir
+        kapi_infos = (ic_kapi_info, dis_kapi_info)
+        kapi_dis_mi = [("ana giriş" in k["kapi_adi"].lower()) for k in self.ev_bilgileri["kapi_listesi"]]
         for i, kapi in enumerate(self.ev_bilgileri["kapi_listesi"]):
-            kategori_kapi = "Dış Kapı" if "ana giriş" in kapi["kapi_adi"].lower() else "İç Kapı"
-            malzeme_info = self.db.malzeme_bilgisi_getir(kategori_kapi)
+            malzeme_info = kapi_infos[kapi_dis_mi[i]]
 
             if malzeme_info and malzeme_info["fiyat"]:
                 malzeme = malzeme_info["malzeme"]
@@ -391,11 +561,12 @@ class EvHesaplayici:
                     "birim_fiyat": fiyat["birim_fiyat"],
                     "maliyet": maliyet
                 }
-                toplam_maliyet_temp += maliyet
+                _maliyet_list.append(maliyet)
             # else:
-            #     flash(f"Kapı {i+1} için '{kategori_kapi}' bilgisi veritabanında bulunamadı veya fiyatı yok.", "warning")
+            #     flash(f"Kapı {i+1} için '{('İç Kapı', 'Dış Kapı')[kapi_dis_mi[i]]}' bilgisi veritabanında bulunamadı veya fiyatı yok.", "warning")
 
         # --- Tesisat ve Bağlantı Elemanları (Basitleştirilmiş Yüzde Yaklaşımı) ---
+        toplam_maliyet_temp = sum(_maliyet_list, 0.0)
         tesisat_baglanti_orani = 0.15
         tahmini_tesisat_maliyeti = toplam_maliyet_temp * tesisat_baglanti_orani
         self.malzeme_ihtiyaclari["Tesisat ve Bağlantı Elemanları (Tahmini)"] = {
@@ -415,64 +586,161 @@ class EvHesaplayici:
 app = FastAPI()
 templates = Jinja2Templates(directory="templates")
 
-# FastAPI startup event'i ile veritabanını başlatma ve örnek verileri ekleme
-@app.on_event("startup")
-async def startup_event():
-    db_yoneticisi.baglan()
+# Tabloları oluşturur ve örnek verileri ekler
+def veritabanini_hazirla(db_yoneticisi: VeritabaniYoneticisi):
     db_yoneticisi.tablo_olustur()
+    conn = db_yoneticisi.baglan()
+    if not conn:
+        return
+
+    cursor = conn.cursor()
+    if cursor.execute("SELECT COUNT(*) FROM Malzemeler").fetchone()[0] > 0:
+        print("Veritabanında malzemeler zaten mevcut, örnek veriler eklenmedi.")
+        return
 
     print("Veritabanına örnek malzemeler ekleniyor...")
     current_date = datetime.date.today().isoformat()
 
-    malzeme_ids = {}
-    malzeme_ids['Duvar Paneli'] = db_yoneticisi.veri_ekle("Malzemeler", {"malzeme_adi": "Duvar Paneli", "malzeme_kategori": "Yapısal", "birim_olcu_tipi": "m2", "varsayilan_fire_orani": 0.05, "aciklama": "Prefabric ev duvar paneli"})
-    malzeme_ids['Çatı Paneli'] = db_yoneticisi.veri_ekle("Malzemeler", {"malzeme_adi": "Çatı Paneli", "malzeme_kategori": "Yapısal", "birim_olcu_tipi": "m2", "varsayilan_fire_orani": 0.07, "aciklama": "Prefabric ev çatı paneli"})
-    malzeme_ids['Fayans'] = db_yoneticisi.veri_ekle("Malzemeler", {"malzeme_adi": "Fayans", "malzeme_kategori": "Zemin Kaplama", "birim_olcu_tipi": "m2", "varsayilan_fire_orani": 0.10, "aciklama": "Standart seramik fayans"})
-    malzeme_ids['Laminat Parke'] = db_yoneticisi.veri_ekle("Malzemeler", {"malzeme_adi": "Laminat Parke", "malzeme_kategori": "Zemin Kaplama", "birim_olcu_tipi": "m2", "varsayilan_fire_orani": 0.07, "aciklama": "8mm laminat parke"})
-    malzeme_ids['Boya'] = db_yoneticisi.veri_ekle("Malzemeler", {"malzeme_adi": "Boya", "malzeme_kategori": "Duvar Kaplama", "birim_olcu_tipi": "litre", "varsayilan_fire_orani": 0.05, "aciklama": "Su bazlı iç cephe boyası"})
-    malzeme_ids['PVC Pencere'] = db_yoneticisi.veri_ekle("Malzemeler", {"malzeme_adi": "PVC Pencere", "malzeme_kategori": "Doğrama", "birim_olcu_tipi": "adet", "varsayilan_fire_orani": 0.00, "aciklama": "Isıcamlı PVC pencere"})
-    malzeme_ids['İç Kapı'] = db_yoneticisi.veri_ekle("Malzemeler", {"malzeme_adi": "İç Kapı", "malzeme_kategori": "Doğrama", "birim_olcu_tipi": "adet", "varsayilan_fire_orani": 0.00, "aciklama": "Panel iç oda kapısı"})
-    malzeme_ids['Dış Kapı'] = db_yoneticisi.veri_ekle("Malzemeler", {"malzeme_adi": "Dış Kapı", "malzeme_kategori": "Doğrama", "birim_olcu_tipi": "adet", "varsayilan_fire_orani": 0.00, "aciklama": "Çelik dış kapı"})
-
-    if malzeme_ids['Duvar Paneli']: db_yoneticisi.veri_ekle("Fiyatlar", {"malzeme_id": malzeme_ids['Duvar Paneli'], "birim_fiyat": 120.00, "gecerlilik_tarihi": current_date, "tedarikci": "A Panel"})
-    if malzeme_ids['Çatı Paneli']: db_yoneticisi.veri_ekle("Fiyatlar", {"malzeme_id": malzeme_ids['Çatı Paneli'], "birim_fiyat": 150.00, "gecerlilik_tarihi": current_date, "tedarikci": "B Çatı"})
-    if malzeme_ids['Fayans']: db_yoneticisi.veri_ekle("Fiyatlar", {"malzeme_id": malzeme_ids['Fayans'], "birim_fiyat": 50.00, "gecerlilik_tarihi": current_date, "tedarikci": "C Yapı"})
-    if malzeme_ids['Laminat Parke']: db_yoneticisi.veri_ekle("Fiyatlar", {"malzeme_id": malzeme_ids['Laminat Parke'], "birim_fiyat": 80.00, "gecerlilik_tarihi": current_date, "tedarikci": "D Zemin"})
-    if malzeme_ids['Boya']: db_yoneticisi.veri_ekle("Fiyatlar", {"malzeme_id": malzeme_ids['Boya'], "birim_fiyat": 50.00, "gecerlilik_tarihi": current_date, "tedarikci": "E Boya"})
-    if malzeme_ids['PVC Pencere']: db_yoneticisi.veri_ekle("Fiyatlar", {"malzeme_id": malzeme_ids['PVC Pencere'], "birim_fiyat": 1500.00, "gecerlilik_tarihi": current_date, "tedarikci": "F Pencere"})
-    if malzeme_ids['İç Kapı']: db_yoneticisi.veri_ekle("Fiyatlar", {"malzeme_id": malzeme_ids['İç Kapı'], "birim_fiyat": 800.00, "gecerlilik_tarihi": current_date, "tedarikci": "G Kapı"})
-    if malzeme_ids['Dış Kapı']: db_yoneticisi.veri_ekle("Fiyatlar", {"malzeme_id": malzeme_ids['Dış Kapı'], "birim_fiyat": 2000.00, "gecerlilik_tarihi": current_date, "tedarikci": "G Kapı"})
-
-    if malzeme_ids['Boya']: db_yoneticisi.veri_ekle("Sarfiyatlar", {"malzeme_id": malzeme_ids['Boya'], "uygulama_turu": "Duvar", "sarfiyat_degeri": 0.15, "sarfiyat_birimi": "litre/m2"})
-
-    if malzeme_ids['Fayans']: db_yoneticisi.veri_ekle("UygulamaDetaylari", {"oda_tipi": "Banyo", "uygulama_alani": "Zemin", "varsayilan_malzeme_kategori": "Fayans", "varsayilan_malzeme_id": malzeme_ids['Fayans'], "ek_ozellikler": json.dumps({"fayans_boyut_m2": 0.09})})
-    if malzeme_ids['Fayans']: db_yoneticisi.veri_ekle("UygulamaDetaylari", {"oda_tipi": "Mutfak", "uygulama_alani": "Zemin", "varsayilan_malzeme_kategori": "Fayans", "varsayilan_malzeme_id": malzeme_ids['Fayans'], "ek_ozellikler": json.dumps({"fayans_boyut_m2": 0.09})})
-    if malzeme_ids['Boya']: db_yoneticisi.veri_ekle("UygulamaDetaylari", {"oda_tipi": "Salon", "uygulama_alani": "Duvar", "varsayilan_malzeme_kategori": "Boya", "varsayilan_malzeme_id": malzeme_ids['Boya'], "ek_ozellikler": json.dumps({"kat_sayisi": 2})})
-    if malzeme_ids['Boya']: db_yoneticisi.veri_ekle("UygulamaDetaylari", {"oda_tipi": "Yatak Odası", "uygulama_alani": "Duvar", "varsayilan_malzeme_kategori": "Boya", "varsayilan_malzeme_id": malzeme_ids['Boya'], "ek_ozellikler": json.dumps({"kat_sayisi": 2})})
-    if malzeme_ids['Laminat Parke']: db_yoneticisi.veri_ekle("UygulamaDetaylari", {"oda_tipi": "Salon", "uygulama_alani": "Zemin", "varsayilan_malzeme_kategori": "Laminat Parke", "varsayilan_malzeme_id": malzeme_ids['Laminat Parke'], "ek_ozellikler": json.dumps({})})
+    malzemeler_rows = [
+        ("Duvar Paneli", "Yapısal", "m2", 0.05, "Prefabric ev duvar paneli"),
+        ("Çatı Paneli", "Yapısal", "m2", 0.07, "Prefabric ev çatı paneli"),
+        ("Fayans", "Zemin Kaplama", "m2", 0.10, "Standart seramik fayans"),
+        ("Laminat Parke", "Zemin Kaplama", "m2", 0.07, "8mm laminat parke"),
+        ("Boya", "Duvar Kaplama", "litre", 0.05, "Su bazlı iç cephe boyası"),
+        ("PVC Pencere", "Doğrama", "adet", 0.00, "Isıcamlı PVC pencere"),
+        ("İç Kapı", "Doğrama", "adet", 0.00, "Panel iç oda kapısı"),
+        ("Dış Kapı", "Doğrama", "adet", 0.00, "Çelik dış kapı"),
+    ]
+
+    try:
+        # Tüm örnek veriler tek bir işlemde (tek commit ile) eklenir
+        cursor.execute("BEGIN")
+        cursor.executemany("""
+            INSERT OR IGNORE INTO Malzemeler (malzeme_adi, malzeme_kategori, birim_olcu_tipi, varsayilan_fire_orani, aciklama)
+            VALUES (?, ?, ?, ?, ?)
+        """, malzemeler_rows)
+
+        malzeme_adlari = [row[0] for row in malzemeler_rows]
+        yer_tutucular = ', '.join(['?' for _ in malzeme_adlari])
+        malzeme_ids = {
+            row["malzeme_adi"]: row["malzeme_id"]
+            for row in cursor.execute(f"SELECT malzeme_adi, malzeme_id FROM Malzemeler WHERE malzeme_adi IN ({yer_tutucular})", malzeme_adlari)
+        }
 
+        fiyatlar_rows = [
+            (malzeme_ids['Duvar Paneli'], 120.00, current_date, "A Panel"),
+            (malzeme_ids['Çatı Paneli'], 150.00, current_date, "B Çatı"),
+            (malzeme_ids['Fayans'], 50.00, current_date, "C Yapı"),
+            (malzeme_ids['Laminat Parke'], 80.00, current_date, "D Zemin"),
+            (malzeme_ids['Boya'], 50.00, current_date, "E Boya"),
+            (malzeme_ids['PVC Pencere'], 1500.00, current_date, "F Pencere"),
+            (malzeme_ids['İç Kapı'], 800.00, current_date, "G Kapı"),
+            (malzeme_ids['Dış Kapı'], 2000.00, current_date, "G Kapı"),
+        ]
+        cursor.executemany("""
+            INSERT INTO Fiyatlar (malzeme_id, birim_fiyat, gecerlilik_tarihi, tedarikci)
+            VALUES (?, ?, ?, ?)
+        """, fiyatlar_rows)
+
+        sarfiyatlar_rows = [
+            (malzeme_ids['Boya'], "Duvar", 0.15, "litre/m2"),
+        ]
+        cursor.executemany("""
+            INSERT INTO Sarfiyatlar (malzeme_id, uygulama_turu, sarfiyat_degeri, sarfiyat_birimi)
+            VALUES (?, ?, ?, ?)
+        """, sarfiyatlar_rows)
+
+        uygulama_detaylari_rows = [
+            ("Banyo", "Zemin", "Fayans", malzeme_ids['Fayans'], json.dumps({"fayans_boyut_m2": 0.09})),
+            ("Mutfak", "Zemin", "Fayans", malzeme_ids['Fayans'], json.dumps({"fayans_boyut_m2": 0.09})),
+            ("Salon", "Duvar", "Boya", malzeme_ids['Boya'], json.dumps({"kat_sayisi": 2})),
+            ("Yatak Odası", "Duvar", "Boya", malzeme_ids['Boya'], json.dumps({"kat_sayisi": 2})),
+            ("Salon", "Zemin", "Laminat Parke", malzeme_ids['Laminat Parke'], json.dumps({})),
+        ]
+        cursor.executemany("""
+            INSERT INTO UygulamaDetaylari (oda_tipi, uygulama_alani, varsayilan_malzeme_kategori, varsayilan_malzeme_id, ek_ozellikler)
+            VALUES (?, ?, ?, ?, ?)
+        """, uygulama_detaylari_rows)
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Örnek veri ekleme hatası: {e}")
+        return
+
+    _invalidate_kaplama_cache()
     print("Veritabanı kurulumu tamamlandı ve örnek veriler eklendi.")
 
-# FastAPI shutdown event'i ile veritabanı bağlantısını kapatma
+# FastAPI startup event'i ile bağlantı havuzunu açma, veritabanını başlatma ve örnek verileri ekleme
+@app.on_event("startup")
+async def startup_event():
+    db_havuzu.ac()
+    conn = await db_havuzu.acquire()
+    try:
+        veritabanini_hazirla(VeritabaniYoneticisi(conn=conn))
+    finally:
+        db_havuzu.release(conn)
+    db_havuzu.isit()
+
+# FastAPI shutdown event'i ile havuzdaki bağlantıları kapatma
 @app.on_event("shutdown")
 async def shutdown_event():
-    db_yoneticisi.baglantiyi_kapat()
+    db_havuzu.kapat()
+
+# Havuzda boş bağlantı yoksa bir isteğin en fazla bekleyeceği süre (saniye)
+DB_BAGLANTI_BEKLEME_SURESI = 2.0
 
-# Bağımlılık ekleme için bir yardımcı fonksiyon
-def get_db():
+# Bağımlılık ekleme için yardımcı fonksiyonlar
+# Her istek havuzdan bir bağlantı ödünç alır ve istek bitince bağlantıyı kapatmadan geri bırakır.
+# Aynı istekte get_conn ve get_db birlikte kullanılırsa FastAPI aynı bağlantıyı paylaştırır.
+async def get_conn():
     try:
-        yield db_yoneticisi
+        conn = await db_havuzu.acquire(timeout=DB_BAGLANTI_BEKLEME_SURESI)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Veritabanı bağlantısı için bekleme süresi aşıldı")
+    try:
+        yield conn
     finally:
-        db_yoneticisi.baglantiyi_kapat() # Her request sonunda bağlantıyı kapat
+        db_havuzu.release(conn)
+
+
+async def get_db(conn: sqlite3.Connection = Depends(get_conn)):
+    return VeritabaniYoneticisi(conn=conn)
+
+
+# Kaplama tipleri istek sıklığında değişmediği için kısa süreli bellekte tutulur
+KAPLAMA_CACHE_SURESI = 60  # saniye
+_KAPLAMA_CACHE = {"value": None, "ts": 0.0}
+_KAPLAMA_LOCK = threading.Lock()
+
+
+def _invalidate_kaplama_cache():
+    with _KAPLAMA_LOCK:
+        _KAPLAMA_CACHE["value"] = None
+        _KAPLAMA_CACHE["ts"] = 0.0
 
 
 def get_oda_kaplama_tipleri(db: VeritabaniYoneticisi = Depends(get_db)):
-    malzemeler_raw = db.veri_sorgula("Malzemeler", kosullar={})
-    kaplama_tipleri = set()
-    for row in malzemeler_raw:
-        if row['malzeme_kategori'] in ('Zemin Kaplama', 'Duvar Kaplama'):
-            kaplama_tipleri.add(row['malzeme_adi'])
-    return sorted(list(kaplama_tipleri))
+    with _KAPLAMA_LOCK:
+        if _KAPLAMA_CACHE["value"] is not None and time.monotonic() - _KAPLAMA_CACHE["ts"] < KAPLAMA_CACHE_SURESI:
+            return list(_KAPLAMA_CACHE["value"])
+
+    conn = db.baglan()
+    if not conn: return []
+    try:
+        rows = conn.execute("""
+            SELECT DISTINCT malzeme_adi FROM Malzemeler
+            WHERE malzeme_kategori IN ('Zemin Kaplama', 'Duvar Kaplama')
+            ORDER BY malzeme_adi
+        """).fetchall()
+    except sqlite3.Error as e:
+        print(f"Kaplama tipleri sorgulama hatası: {e}")
+        return []
+    kaplama_tipleri = [r[0] for r in rows]
+
+    with _KAPLAMA_LOCK:
+        _KAPLAMA_CACHE["value"] = kaplama_tipleri
+        _KAPLAMA_CACHE["ts"] = time.monotonic()
+    return list(kaplama_tipleri)
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -578,108 +846,119 @@ async def calculate_cost(
         })
 
 
-@app.get("/admin/fiyatlar", response_class=HTMLResponse)
-async def get_admin_fiyatlar(request: Request, db: VeritabaniYoneticisi = Depends(get_db)):
-    conn = db.baglan()
-    if not conn:
-        messages = [{"type": "danger", "message": "Veritabanı bağlantısı kurulamadı. Fiyatlar görüntülenemiyor."}]
-        return templates.TemplateResponse('admin_fiyatlar.html', {"request": request, "malzemeler": [], "messages": messages})
+# Yönetim sayfasında listelenen malzemeler ve güncel fiyatları.
+# SQL metni sabit tutulduğundan sqlite3'ün hazır ifade önbelleği her istekte aynı planı kullanır.
+LATEST_PRICES_SQL = """
+    SELECT
+        M.malzeme_id,
+        M.malzeme_adi,
+        M.birim_olcu_tipi,
+        F.birim_fiyat,
+        F.gecerlilik_tarihi
+    FROM Malzemeler AS M
+    LEFT JOIN Fiyatlar AS F ON F.fiyat_id = M.latest_fiyat_id
+    ORDER BY M.malzeme_adi
+"""
+
+
+# LATEST_PRICES_SQL satırları; şablondaki malzeme.birim_fiyat gibi erişimler doğrudan öznitelik okumasıdır
+MalzemeFiyatSatiri = namedtuple("MalzemeFiyatSatiri", ["malzeme_id", "malzeme_adi", "birim_olcu_tipi", "birim_fiyat", "gecerlilik_tarihi"])
 
+
+def _malzeme_fiyat_satiri(cursor, row):
+    return MalzemeFiyatSatiri._make(row)
+
+
+def _fetch_latest_prices(conn):
+    # Satırlar listeye alınmadan imleçle döndürülür; şablon render edilirken tek tek okunur.
+    # TemplateResponse şablonu hemen render ettiğinden imleç bağlantı havuza dönmeden tüketilir.
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT
-            M.malzeme_id,
-            M.malzeme_adi,
-            M.birim_olcu_tipi,
-            F.birim_fiyat,
-            F.gecerlilik_tarihi
-        FROM Malzemeler AS M
-        LEFT JOIN (
-            SELECT
-                malzeme_id,
-                birim_fiyat,
-                gecerlilik_tarihi,
-                ROW_NUMBER() OVER (PARTITION BY malzeme_id ORDER BY gecerlilik_tarihi DESC, fiyat_id DESC) as rn
-            FROM Fiyatlar
-        ) AS F ON M.malzeme_id = F.malzeme_id AND F.rn = 1
-        ORDER BY M.malzeme_adi;
-    """)
-    malzemeler_ve_fiyatlar = cursor.fetchall()
-
-    return templates.TemplateResponse('admin_fiyatlar.html', {"request": request, "malzemeler": malzemeler_ve_fiyatlar, "messages": []})
-
-
-@app.post("/admin/fiyatlar", response_class=HTMLResponse) # veya RedirectResponse
-async def post_admin_fiyatlar(request: Request, db: VeritabaniYoneticisi = Depends(get_db)):
-    messages = []
+    cursor.row_factory = _malzeme_fiyat_satiri
+    return cursor.execute(LATEST_PRICES_SQL, ())
+
+
+# POST sonrası yönlendirmede mesajlar kısa ömürlü bir çerezle GET isteğine taşınır
+FLASH_COOKIE = "flash"
+# Tarayıcılar ~4 KB'tan büyük çerezleri atar; mesaj metinleri bu sınıra kırpılır
+FLASH_MESAJ_SINIRI = 300
+
+
+def _kisalt(metin, sinir):
+    return metin if len(metin) <= sinir else metin[:sinir] + "..."
+
+
+def _flash_ile_yonlendir(url, messages):
+    messages = [{**m, "message": _kisalt(m["message"], FLASH_MESAJ_SINIRI)} for m in messages]
+    response = RedirectResponse(url=url, status_code=status.HTTP_303_SEE_OTHER)
+    response.set_cookie(FLASH_COOKIE, json.dumps(messages), max_age=10, httponly=True)
+    return response
+
+
+def _flash_mesajlari(request: Request):
     try:
-        conn = db.baglan()
-        if not conn:
-            messages.append({"type": "danger", "message": "Veritabanı bağlantısı kurulamadı. Fiyatlar güncellenemedi."})
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="DB Connection Error")
+        messages = json.loads(request.cookies.get(FLASH_COOKIE, "[]"))
+    except json.JSONDecodeError:
+        return []
+    if not isinstance(messages, list):
+        return []
+    return [m for m in messages if isinstance(m, dict) and isinstance(m.get("type"), str) and isinstance(m.get("message"), str)]
+
+
+@app.get("/admin/fiyatlar", response_class=HTMLResponse)
+async def get_admin_fiyatlar(request: Request, conn: sqlite3.Connection = Depends(get_conn)):
+    messages = _flash_mesajlari(request)
+    malzemeler_ve_fiyatlar = _fetch_latest_prices(conn)
+
+    response = templates.TemplateResponse('admin_fiyatlar.html', {"request": request, "malzemeler": malzemeler_ve_fiyatlar, "messages": messages})
+    if FLASH_COOKIE in request.cookies:
+        response.delete_cookie(FLASH_COOKIE)
+    return response
+
 
+@app.post("/admin/fiyatlar", response_class=RedirectResponse)
+async def post_admin_fiyatlar(request: Request, conn: sqlite3.Connection = Depends(get_conn)):
+    messages = []
+    try:
         today_date = datetime.date.today().isoformat()
         form_data = await request.form()
 
-        for key, value in form_data.items():
+        # Önce tüm değerler ayrıştırılır; hatalı bir değer varsa hiçbir fiyat yazılmaz.
+        # Aynı malzeme için birden çok alan gelirse son değer geçerlidir, her malzeme bir kez yazılır.
+        yeni_fiyatlar = {}
+        for key, value in form_data.multi_items():
             if key.startswith('birim_fiyat_'):
-                malzeme_id = key.replace('birim_fiyat_', '')
-                birim_fiyat = float(value)
-
-                existing_price_for_today = conn.execute("""
-                    SELECT fiyat_id
-                    FROM Fiyatlar
-                    WHERE malzeme_id = ? AND gecerlilik_tarihi = ?
-                """, (malzeme_id, today_date)).fetchone()
-
-                if existing_price_for_today:
-                    db.veri_guncelle(
-                        "Fiyatlar",
-                        {"birim_fiyat": birim_fiyat},
-                        {"fiyat_id": existing_price_for_today['fiyat_id']}
-                    )
-                else:
-                    db.veri_ekle(
-                        "Fiyatlar",
-                        {"malzeme_id": int(malzeme_id), "birim_fiyat": birim_fiyat, "gecerlilik_tarihi": today_date}
-                    )
+                try:
+                    malzeme_id = int(key[len('birim_fiyat_'):])
+                    birim_fiyat = float(value)
+                    if not math.isfinite(birim_fiyat):
+                        raise ValueError
+                except ValueError:
+                    raise ValueError(f"{_kisalt(key, 40)}: '{_kisalt(str(value), 40)}'")
+                yeni_fiyatlar[malzeme_id] = birim_fiyat
+        rows = [(malzeme_id, birim_fiyat, today_date) for malzeme_id, birim_fiyat in yeni_fiyatlar.items()]
+
+        # Bugüne ait fiyat varsa güncellenir, yoksa eklenir; tümü tek işlemde yazılır.
+        # Yazma kilidi işlem başında alınır; WAL kipinde commit tek bir günlük eklemesidir.
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("""
+                INSERT INTO Fiyatlar (malzeme_id, birim_fiyat, gecerlilik_tarihi)
+                VALUES (?, ?, ?)
+                ON CONFLICT(malzeme_id, gecerlilik_tarihi) DO UPDATE SET birim_fiyat = excluded.birim_fiyat
+            """, rows)
+        _invalidate_kaplama_cache()
         messages.append({"type": "success", "message": "Fiyatlar başarıyla güncellendi!"})
-        # Başarılı olduğunda GET isteğine yönlendir
-        return RedirectResponse(url="/admin/fiyatlar", status_code=status.HTTP_303_SEE_OTHER)
 
-    except ValueError:
-        messages.append({"type": "danger", "message": "Geçersiz fiyat değeri girildi. Lütfen sayısal bir değer girin."})
-    except HTTPException:
-        pass # Already handled
+    except ValueError as ve:
+        messages.append({"type": "danger", "message": f"Geçersiz fiyat değeri girildi ({ve}). Lütfen sayısal bir değer girin."})
     except Exception as e:
         messages.append({"type": "danger", "message": f"Fiyatlar güncellenirken bir hata oluştu: {e}"})
 
-    # Hata durumunda formu tekrar render et
-    conn = db.baglan()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT
-            M.malzeme_id,
-            M.malzeme_adi,
-            M.birim_olcu_tipi,
-            F.birim_fiyat,
-            F.gecerlilik_tarihi
-        FROM Malzemeler AS M
-        LEFT JOIN (
-            SELECT
-                malzeme_id,
-                birim_fiyat,
-                gecerlilik_tarihi,
-                ROW_NUMBER() OVER (PARTITION BY malzeme_id ORDER BY gecerlilik_tarihi DESC, fiyat_id DESC) as rn
-            FROM Fiyatlar
-        ) AS F ON M.malzeme_id = F.malzeme_id AND F.rn = 1
-        ORDER BY M.malzeme_adi;
-    """)
-    malzemeler_ve_fiyatlar = cursor.fetchall()
-    return templates.TemplateResponse('admin_fiyatlar.html', {"request": request, "malzemeler": malzemeler_ve_fiyatlar, "messages": messages})
-
-# Uygulama başlatıldığında çalıştırılacak global db yöneticisi
-db_yoneticisi = VeritabaniYoneticisi()
+    # Başarıda da hatada da GET isteğine yönlendir; mesajlar orada gösterilir
+    return _flash_ile_yonlendir("/admin/fiyatlar", messages)
+
+# Uygulama başlatıldığında açılacak global bağlantı havuzu
+db_havuzu = SQLitePool(boyut=int(os.getenv("DB_HAVUZ_BOYUTU", "5")))
 
 # main.py veya başka bir dosyada `uvicorn app:app --reload` ile çalıştırılabilir.
 # `if __name__ == '__main__':` bloğu, FastAPI ile genellikle uvicorn üzerinden çalıştığı için kaldırılır.
\ No newline at end of file
@@ -0,0 +1,50 @@
+import pytest
+
+from app import EvHesaplayici, VeritabaniYoneticisi, veritabanini_hazirla
+
+TESISAT_KALEMI = "Tesisat ve Bağlantı Elemanları (Tahmini)"
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = VeritabaniYoneticisi(db_adi=str(tmp_path / "test.db"))
+    veritabanini_hazirla(db)
+    yield db
+    db.baglantiyi_kapat()
+
+
+def _ev_data(duvar_kaplama_tipi):
+    return {
+        "ev_tipi": "Müstakil",
+        "kat_sayisi": 1,
+        "cati_tipi": "Düz",
+        "cati_egim_acisi": 0.0,
+        "oda_listesi": [
+            {"oda_adi": "Salon", "uzunluk": 5.0, "genislik": 4.0, "yukseklik": 2.7,
+             "zemin_kaplama_tipi": "Laminat Parke", "duvar_kaplama_tipi": duvar_kaplama_tipi},
+        ],
+        "pencere_listesi": [{"pencere_adi": "Pencere 1", "genislik": 1.2, "yukseklik": 1.5, "adet": 2}],
+        "kapi_listesi": [{"kapi_adi": "Ana Giriş", "genislik": 1.0, "yukseklik": 2.1, "adet": 1}],
+    }
+
+
+def _kalem_toplami(malzeme_ihtiyaclari):
+    return sum(v["maliyet"] for k, v in malzeme_ihtiyaclari.items() if k != TESISAT_KALEMI)
+
+
+def test_boya_duvari_toplamda_bir_kez_sayilir(db):
+    malzeme_ihtiyaclari, toplam = EvHesaplayici(db, _ev_data("Boya")).malzeme_ihtiyacini_hesapla()
+
+    assert "Salon Duvar (Boya)" in malzeme_ihtiyaclari
+    assert toplam == pytest.approx(_kalem_toplami(malzeme_ihtiyaclari) * 1.15)
+
+
+def test_sarfiyati_olmayan_boya_duvari_toplama_eklenmez(db):
+    conn = db.baglan()
+    conn.execute("DELETE FROM Sarfiyatlar WHERE uygulama_turu = 'Duvar'")
+    conn.commit()
+
+    malzeme_ihtiyaclari, toplam = EvHesaplayici(db, _ev_data("Boya")).malzeme_ihtiyacini_hesapla()
+
+    assert "Salon Duvar (Boya)" not in malzeme_ihtiyaclari
+    assert toplam == pytest.approx(_kalem_toplami(malzeme_ihtiyaclari) * 1.15)